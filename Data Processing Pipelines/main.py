@@ -7,13 +7,6 @@ import utils.data_processing_silver_table
 import utils.data_processing_gold_table
 from utils.date_utils import generate_first_of_month_dates
 import shutil
-import glob
-
-def save_single_parquet(df, tmp_dir, final_path):
-    df.repartition(1).write.mode("overwrite").parquet(tmp_dir)
-    part_file = glob.glob(os.path.join(tmp_dir, 'part-*.parquet'))[0]
-    shutil.move(part_file, final_path)
-    shutil.rmtree(tmp_dir)
 
 # Load raw data
 clickstream = pd.read_csv('data/feature_clickstream.csv')
@@ -30,6 +23,11 @@ os.makedirs('datamart/bronze', exist_ok=True)
 spark = pyspark.sql.SparkSession.builder \
     .appName("dev") \
     .master("local[*]") \
+    .config("spark.sql.execution.arrow.pyspark.enabled", "true") \
+    .config("spark.sql.parquet.enableVectorizedReader", "true") \
+    .config("spark.sql.parquet.filterPushdown", "true") \
+    .config("spark.sql.parquet.compression.codec", "snappy") \
+    .config("spark.sql.files.maxPartitionBytes", "128m") \
     .getOrCreate()
 
 spark.sparkContext.setLogLevel("ERROR")
@@ -84,6 +82,11 @@ features.to_csv('datamart/gold/feature_store.csv', index=False)
 spark = pyspark.sql.SparkSession.builder \
     .appName("dev") \
     .master("local[*]") \
+    .config("spark.sql.execution.arrow.pyspark.enabled", "true") \
+    .config("spark.sql.parquet.enableVectorizedReader", "true") \
+    .config("spark.sql.parquet.filterPushdown", "true") \
+    .config("spark.sql.parquet.compression.codec", "snappy") \
+    .config("spark.sql.files.maxPartitionBytes", "128m") \
     .getOrCreate()
 
 spark.sparkContext.setLogLevel("ERROR")
@@ -126,6 +129,17 @@ for d in gold_dirs.values():
     if not os.path.exists(d):
         os.makedirs(d)
 
+# Remove per-date outputs from the old gold layout (gold_*_store_YYYY_MM_DD.parquet);
+# they would clash with partition discovery on the snapshot_date-partitioned stores
+for d in gold_dirs.values():
+    for name in os.listdir(d):
+        old_path = os.path.join(d, name)
+        if name.startswith(("gold_", "tmp_gold_")):
+            if os.path.isdir(old_path):
+                shutil.rmtree(old_path)
+            else:
+                os.remove(old_path)
+
 # Process bronze tables for each date
 for date_str in dates_str_lst:
     utils.data_processing_bronze_table.process_bronze_table(date_str, bronze_dirs, spark)
@@ -162,23 +176,23 @@ for date_str in dates_str_lst:
     )
 
 # Process gold feature store for each date (feature engineering)
-# Process gold feature store for each date
+# Gold tables are written partitioned by snapshot_date inside the processing functions
+# Load the silver feature tables once and reuse them for every snapshot date
+silver_feature_dfs = utils.data_processing_gold_table.load_silver_feature_tables(silver_dirs, spark)
 for date_str in dates_str_lst:
-    feature_df = utils.data_processing_gold_table.process_features_gold_table(
+    utils.data_processing_gold_table.process_features_gold_table(
         date_str, 
         silver_dirs, 
         gold_dirs,
-        spark
+        spark,
+        silver_dfs=silver_feature_dfs
     )
-    if feature_df is not None:
-        tmp_dir = gold_dirs["feature_store"] + f"tmp_gold_feature_store_{date_str.replace('-','_')}"
-        final_file = gold_dirs["feature_store"] + f"gold_feature_store_{date_str.replace('-','_')}.parquet"
-        save_single_parquet(feature_df, tmp_dir, final_file)
-        print(f"Saved gold features to: {final_file}")  # Added logging
+for silver_df in silver_feature_dfs.values():
+    silver_df.unpersist()
 
 # Process gold label store for each date
 for date_str in dates_str_lst:
-    label_df = utils.data_processing_gold_table.process_labels_gold_table(
+    utils.data_processing_gold_table.process_labels_gold_table(
         date_str, 
         silver_dirs["loans"],  # Changed from "loan_daily" to "loans"
         gold_dirs["label_store"], 
@@ -186,15 +200,9 @@ for date_str in dates_str_lst:
         dpd=30, 
         mob=6
     )
-    if label_df is not None:
-        tmp_dir = gold_dirs["label_store"] + f"tmp_gold_label_store_{date_str.replace('-','_')}"
-        final_file = gold_dirs["label_store"] + f"gold_label_store_{date_str.replace('-','_')}.parquet"
-        save_single_parquet(label_df, tmp_dir, final_file)
 
 
-# Example: Load and show gold feature store
-folder_path = gold_dirs["feature_store"]
-files_list = [folder_path+os.path.basename(f) for f in glob.glob(os.path.join(folder_path, '*'))]
-df = spark.read.option("header", "true").parquet(*files_list)
+# Example: Load and show gold feature store (snapshot_date is recovered from the partition directories)
+df = spark.read.parquet(gold_dirs["feature_store"])
 print("row_count:", df.count())
 df.show()
\ No newline at end of file